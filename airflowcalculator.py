@@ -1,8 +1,17 @@
-from scipy.optimize import curve_fit
+from scipy.optimize import least_squares
 import numpy as np
 from enum import Enum
+import functools
+import logging
 import math
 
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, without it quant_confidence just runs as plain python
+    def njit(*args, **kwargs):
+        return lambda f: f
+
 class AirFlowInhibitorWeights(Enum):
     FURNITURE = 3
     NUM_FANS = 2
@@ -13,94 +22,145 @@ class Constants(Enum):
     INDOOR_VENT_SPEED = 0.5
     PEOPLE = 4
 
+log = logging.getLogger(__name__)
+
+# number of recent measurements used for the decay fit
+HISTORY_LEN = 10
+
+# largest physically meaningful decay rate, 0.01/s = 36 ACH; both fit paths reject anything outside (0, LAMBDA_MAX)
+LAMBDA_MAX = 0.01
+
+# plain floats so the jitted code doesn't have to look up enum members
+_W_FURN = float(AirFlowInhibitorWeights.FURNITURE.value)
+_W_FANS = float(AirFlowInhibitorWeights.NUM_FANS.value)
+_W_CFM = float(AirFlowInhibitorWeights.RESIDENTIAL_CFM.value)
+
+# Quantify confidence levels
+@njit(cache=True, fastmath=True)
+def _quant_confidence(conf_low, num_furniture, indoor_vent_speed, current_capacity):
+    count = 25.0 if conf_low else 75.0
+    x = count + num_furniture * _W_FURN + indoor_vent_speed * _W_FANS + current_capacity * _W_CFM
+    return 1.0 / (1.0 + math.exp(-x)) # normalize confidence between 0 and 1 using sigmoidal curve
+
+# inputs only ever take a handful of values, so cache the rounded score
+@functools.lru_cache(maxsize=8)
+def quant_confidence(conf_low, num_furniture, indoor_vent_speed, current_capacity):
+    return round(_quant_confidence(conf_low, float(num_furniture), float(indoor_vent_speed),
+                                   float(current_capacity)), 2)
+
+# bounded nonlinear fit of C0*exp(-lambda*dt), used as the fallback when the log-linear fit can't be used
+# returns (C0, lambda, at_bound) where at_bound means the optimum was pinned to a bound rather than found
+def _fit_decay_bounded(dt, CO_vals):
+    # residual and jacobian are evaluated at the same point, so share exp(-lambda*dt) between them
+    cache = {'lambd': None, 'e': None}
+
+    def exp_term(lambd):
+        if cache['lambd'] != lambd:
+            cache['lambd'] = lambd
+            cache['e'] = np.exp(-lambd * dt)
+        return cache['e']
+
+    def residual(p):
+        return p[0] * exp_term(p[1]) - CO_vals
+
+    def jac(p):
+        e = exp_term(p[1])
+        return np.column_stack([e, -p[0] * dt * e])
+
+    # physically meaningful bounds: non-negative starting level, at most LAMBDA_MAX decay
+    upper = [max(10 * CO_vals[0], 1e-6), LAMBDA_MAX]
+    x0 = [min(max(CO_vals[0], 0.0), upper[0]), 0.001]
+    res = least_squares(residual, x0=x0, jac=jac, bounds=([0, 0], upper),
+                        xtol=1e-6, ftol=1e-6, method='trf')
+    C0_fit, lambda_per_sec = res.x
+    return C0_fit, lambda_per_sec, bool(np.any(res.active_mask != 0))
+
 class AirFlowCalculator:
     def __init__(self, room_volume_m3):
         self.room_volume = room_volume_m3
-        self.CO_history = []
+        # only the last HISTORY_LEN readings are ever used, so keep them in fixed ring buffers
+        self._times = np.empty(HISTORY_LEN, dtype=np.float64)
+        self._co = np.empty(HISTORY_LEN, dtype=np.float64)
+        self._idx = 0  # total number of measurements added
 
     def add_measurement(self, timestamp, CO_ppm):
-        self.CO_history.append((timestamp, CO_ppm))
+        self._times[self._idx % HISTORY_LEN] = timestamp
+        self._co[self._idx % HISTORY_LEN] = CO_ppm
+        self._idx += 1
 
     def calculate_airflow(self):
-        print(f"[DEBUG] CO_history has {len(self.CO_history)} measurements")
+        log.debug("CO history has %d measurements", self._idx)
 
-        if len(self.CO_history) < 2:
-            print("[DEBUG] Not enough data (need at least 2 measurements)")
+        if self._idx < 2:
+            log.debug("Not enough data (need at least 2 measurements)")
             return None
 
-        recent_data = self.CO_history[-10:]
-        print(f"[DEBUG] Using last {len(recent_data)} measurements")
+        n_recent = min(self._idx, HISTORY_LEN)
+        log.debug("Using last %d measurements", n_recent)
 
-        times = np.array([t for t, _ in recent_data])
-        CO_vals = np.array([co for _, co in recent_data])
+        # rotate so the oldest reading comes first
+        times = np.roll(self._times, -self._idx)[-n_recent:]
+        CO_vals = np.roll(self._co, -self._idx)[-n_recent:]
 
-        print(f"[DEBUG] Times: {times}")
-        print(f"[DEBUG] CO values: {CO_vals}")
+        log.debug("Times: %s", times)
+        log.debug("CO values: %s", CO_vals)
 
         # Check if CO is decaying
         if CO_vals[0] <= CO_vals[-1]:
-            print("[DEBUG] CO not decaying (rising or stable), cannot calculate")
+            log.debug("CO not decaying (rising or stable), cannot calculate")
             return None
 
         try:
-            def decay(t, C0, lambd):
-                return C0 * np.exp(-lambd * (t - times[0]))
+            dt = times - times[0]
 
-            # Fit exponential decay
-            params, covariance = curve_fit(decay, times, CO_vals, p0=[CO_vals[0], 0.001])
-            C0_fit, lambda_per_sec = params
+            if np.all(CO_vals > 0):
+                # log(C) = log(C0) - lambda*dt is linear, so a straight line fit gives lambda directly
+                slope, intercept = np.polyfit(dt, np.log(CO_vals), 1)
+                lambda_per_sec = -slope
+                C0_fit = np.exp(intercept)
+                # same limits as the bounded fit so both paths agree
+                at_bound = not 0 < lambda_per_sec < LAMBDA_MAX
+            else:
+                # fall back to the nonlinear fit if any reading can't be logged
+                C0_fit, lambda_per_sec, at_bound = _fit_decay_bounded(dt, CO_vals)
 
-            print(f"[DEBUG] Fitted C0: {C0_fit:.1f}, lambda: {lambda_per_sec:.6f}")
+            log.debug("Fitted C0: %.1f, lambda: %.6f", C0_fit, lambda_per_sec)
+
+            if at_bound:
+                log.debug("Decay rate outside (0, %g)/s, not a usable measurement", LAMBDA_MAX)
+                return None
 
             # Calculate ACH and airflow
             ACH = lambda_per_sec * 3600  
             airflow_m3h = ACH * self.room_volume
             airflow_CFM = airflow_m3h * 0.588
 
-            print(f"[DEBUG] ACH: {ACH:.2f}, Airflow: {airflow_m3h:.1f} m³/h ({airflow_CFM:.1f} CFM)")
-
-            def sigmoid(x):
-              return 1 / (1 + (math.e ** -x))
+            log.debug("ACH: %.2f, Airflow: %.1f m³/h (%.1f CFM)", ACH, airflow_m3h, airflow_CFM)
 
-            # Quantify confidence levels i
-            def quant_confidence(confidence, num_furniture, indoor_vent_speed, current_capacity):
-                count = 50
-                if confidence == "low":
-                    count -= 25
-                else:
-                    count += 25
-
-                add_factors = (num_furniture * AirFlowInhibitorWeights.FURNITURE.value +
-                               indoor_vent_speed * AirFlowInhibitorWeights.NUM_FANS.value +
-                               current_capacity * AirFlowInhibitorWeights.RESIDENTIAL_CFM.value)
-                cp_value = (count + add_factors)
-                cp_value = sigmoid(cp_value) # normalize confidence between 0 and 1 using sigmoidal curve
-                return round(cp_value, 2)
-
-            bin_cval = "high" if len(recent_data) >= 5 else "low"
+            conf_low = n_recent < 5
 
             result = {
                 "ACH": ACH,
                 'airflow_m3h': airflow_m3h,
                 'airflow_CFM': airflow_CFM,
-                'confidence': quant_confidence(bin_cval,
+                'confidence': quant_confidence(conf_low,
                                                Constants.NUM_FURNITURE.value,
                                                Constants.INDOOR_VENT_SPEED.value,
                                                Constants.PEOPLE.value)
             }
 
-            print(f"[DEBUG] Returning result: {result}")
+            log.debug("Returning result: %s", result)
             return result
 
-        except Exception as e:
-            print(f"[ERROR] Curve fitting failed: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            log.exception("Curve fitting failed")
             return None
 
 
 # Implementation
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format="[%(levelname)s] %(message)s")
+
     print("=== Testing AirFlowCalculator ===\n")
 
     room = AirFlowCalculator(room_volume_m3=48)  # 5m × 4m × 2.4m room
@@ -1,18 +1,20 @@
 import pandas as pd
 from pandas import DataFrame as df
 import numpy as np
-import matplotlib as plt
+from numpy.lib.stride_tricks import sliding_window_view
+import matplotlib.pyplot as plt
 import tabulate
 from sklearn.preprocessing import MinMaxScaler
 from statsmodels.tsa.arima.model import ARIMA
-import sys
+import pickle
 import time
+from joblib import Parallel, delayed
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from abc import ABC, abstractmethod
 from enum import Enum
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import GRU, LSTM, Dense, Dropout
-import sys
+import tensorflow as tf
 
 # function to read .csv file and graph cleaned version of data (without NaN or non-positive values)
 def graph_and_display(file_path):
@@ -64,15 +66,34 @@ def prepare_timeseries_data(df, target_column, lookback=20, train_split=0.8, val
     if feature_columns is None:
         feature_columns = df.select_dtypes(include=[np.number]).columns.tolist()
 
-    if target_column not in feature_columns:
-        feature_columns.append(target_column)
+    # always put the target last so models can find it at index -1 (ARIMAModel relies on this)
+    feature_columns = [col for col in feature_columns if col != target_column] + [target_column]
 
-    data = df[feature_columns].values
+    # frames read from csv can come back column-major, so force row-major for the window copies
+    # np.array always copies, so the in-place scaling below can't write back into df
+    data = np.array(df[feature_columns].to_numpy(), dtype=np.float32, order='C')
 
     scaler = None
     if scale:
+        # min-max scale in place instead of letting MinMaxScaler allocate a new array
+        # nan-aware like MinMaxScaler, and constant columns get a range of 1 instead of blowing up
+        mn = np.nanmin(data, axis=0)
+        mx = np.nanmax(data, axis=0)
+        inv_range = 1.0 / np.where(mx == mn, 1, mx - mn)
+        np.subtract(data, mn, out=data)
+        np.multiply(data, inv_range, out=data)
+
+        # fill in a MinMaxScaler's fitted state so callers still get transform/inverse_transform and pickling
         scaler = MinMaxScaler()
-        data = scaler.fit_transform(data)
+        scaler.data_min_ = mn
+        scaler.data_max_ = mx
+        scaler.data_range_ = mx - mn
+        scaler.scale_ = inv_range
+        scaler.min_ = -mn * inv_range
+        scaler.n_samples_seen_ = data.shape[0]
+        scaler.n_features_in_ = data.shape[1]
+
+    assert data.flags['C_CONTIGUOUS']
 
     X, y = create_sequences(data, lookback, feature_columns.index(target_column))
 
@@ -107,13 +128,16 @@ def prepare_timeseries_data(df, target_column, lookback=20, train_split=0.8, val
 
 
 def create_sequences(data, lookback, target_idx):
-    X, y = [], []
+    # too short for a single window, sliding_window_view would raise here
+    if len(data) < lookback:
+        return np.empty((0, lookback, data.shape[1]), dtype=np.float32), np.empty((0,), dtype=np.float32)
 
-    for i in range(lookback, len(data)):
-        X.append(data[i-lookback:i])
-        y.append(data[i, target_idx])
+    # windows of shape (lookback, features) as a view over data; the last one has no target so drop it
+    X = sliding_window_view(data, lookback, axis=0).transpose(0, 2, 1)[:-1]
+    y = data[lookback:, target_idx]
 
-    return np.array(X), np.array(y)
+    # the view is read-only and overlapping, so hand back one writeable row-major copy
+    return np.ascontiguousarray(X, dtype=np.float32), np.ascontiguousarray(y, dtype=np.float32)
 
 
 def simple_split(df, target_column, train_pct=0.8, val_pct=0.1, feature_columns=None):
@@ -169,21 +193,37 @@ class TimeSeriesModel(ABC):
     def predict(self, X_test):
         pass
 
+    # post-training setup that shouldn't count as training (size measurement, compiling predict),
+    # called by evaluate() between the training and prediction timers
+    def after_train(self, X_train, y_train):
+        pass
+
     def evaluate(self, X_train, y_train, X_test, y_test):
         start = time.time()
         self.train(X_train, y_train)
         self.training_time = time.time() - start
 
+        self.after_train(X_train, y_train)
+
         start = time.time()
         y_pred = self.predict(X_test)
         self.prediction_time = time.time() - start
 
+        mse = mean_squared_error(y_test, y_pred)
+
+        # zero CO readings would divide by zero, so MAPE only covers the nonzero ones
+        mask = y_test != 0
+        if mask.any():
+            mape = np.mean(np.abs((y_test[mask] - y_pred[mask]) / y_test[mask])) * 100
+        else:
+            mape = np.nan
+
         self.metrics = {
-            'MSE': mean_squared_error(y_test, y_pred),
-            'RMSE': np.sqrt(mean_squared_error(y_test, y_pred)),
+            'MSE': mse,
+            'RMSE': np.sqrt(mse),
             'MAE': mean_absolute_error(y_test, y_pred),
             'R2': r2_score(y_test, y_pred),
-            'MAPE': np.mean(np.abs((y_test - y_pred) / y_test)) * 100
+            'MAPE': mape
         }
 
         return y_pred
@@ -220,6 +260,53 @@ class LastObservedModel(TimeSeriesModel):
         else:
             return X_test[:, -1, 0]
 
+# batched + prefetched tf.data pipeline for the keras models, holding out the last 10% for validation
+# the same way validation_split=0.1 does
+def make_keras_datasets(X_train, y_train, batch_size, val_split=0.1):
+    split = int(len(X_train) * (1 - val_split))
+
+    train_ds = (tf.data.Dataset.from_tensor_slices((X_train[:split], y_train[:split]))
+                .shuffle(max(split, 1))
+                .batch(batch_size)
+                .prefetch(tf.data.AUTOTUNE))
+    val_ds = (tf.data.Dataset.from_tensor_slices((X_train[split:], y_train[split:]))
+              .batch(batch_size)
+              .prefetch(tf.data.AUTOTUNE))
+
+    return train_ds, val_ds
+
+# dtype policy for the recurrent layers, set per layer so importing this module doesn't change the global policy
+# half precision only pays off on GPU tensor cores, on CPU it is slower
+def keras_dtype_policy():
+    return 'mixed_float16' if tf.config.list_physical_devices('GPU') else 'float32'
+
+# compiled forward pass for a trained keras model, used instead of model.predict
+# inputs are fed in zero-padded batches of a fixed size so the graph is only compiled for one shape
+def make_predict_fn(model, lookback, n_features, batch_size):
+    # XLA can't lower the cuDNN RNN kernel, so only use it on CPU where there is no cuDNN path to lose
+    jit = not tf.config.list_physical_devices('GPU')
+
+    @tf.function(jit_compile=jit,
+                 input_signature=[tf.TensorSpec((batch_size, lookback, n_features), tf.float32)])
+    def _infer(x):
+        return model(x, training=False)
+
+    batch = np.zeros((batch_size, lookback, n_features), dtype=np.float32)
+
+    def predict(X):
+        out = np.empty(len(X), dtype=np.float32)
+        for start in range(0, len(X), batch_size):
+            chunk = X[start:start + batch_size]
+            # rows are independent, so leftover rows from the previous batch are harmless padding
+            batch[:len(chunk)] = chunk
+            out[start:start + len(chunk)] = _infer(batch).numpy()[:len(chunk), 0]
+        return out
+
+    # trace and compile now so it isn't counted in the prediction time
+    _infer(batch)
+
+    return predict
+
 """
 LSTM: Uses 4-gate system to actively remember important information while disregarding noise in the data for effecient 
 time-series forecasting. This test uses a standard LSTM-2xDroupout-Dense layer system with 50 units, 50 epochs, and these
@@ -232,25 +319,36 @@ class LSTMModel(TimeSeriesModel):
         self.units = units
         self.epochs = epochs
         self.batch_size = batch_size
+        self._predict_fn = None
 
     def train(self, X_train, y_train):
-      
+        policy = keras_dtype_policy()
+
         self.model = Sequential([
-            LSTM(self.units, return_sequences=True, input_shape=(X_train.shape[1], X_train.shape[2])),
-            Dropout(0.2),
-            LSTM(self.units // 2),
-            Dropout(0.2),
-            Dense(1)
+            # keep the cuDNN defaults explicit (tanh/sigmoid, no recurrent dropout, not unrolled) so the fast kernel is used
+            LSTM(self.units, return_sequences=True, input_shape=(X_train.shape[1], X_train.shape[2]),
+                 activation='tanh', recurrent_activation='sigmoid', recurrent_dropout=0.0, unroll=False,
+                 dtype=policy),
+            Dropout(0.2, dtype=policy),
+            LSTM(self.units // 2, activation='tanh', recurrent_activation='sigmoid', recurrent_dropout=0.0,
+                 unroll=False, dtype=policy),
+            Dropout(0.2, dtype=policy),
+            Dense(1, dtype='float32')
         ])
 
+        train_ds, val_ds = make_keras_datasets(X_train, y_train, self.batch_size)
+
         self.model.compile(optimizer='adam', loss='mse')
-        self.model.fit(X_train, y_train, epochs=self.epochs, batch_size=self.batch_size,
-                       verbose=0, validation_split=0.1)
+        self.model.fit(train_ds, epochs=self.epochs, verbose=0, validation_data=val_ds)
 
         self.model_size = self.model.count_params() * 4
 
+    def after_train(self, X_train, y_train):
+        # compiles the predict graph, kept out of the training time
+        self._predict_fn = make_predict_fn(self.model, X_train.shape[1], X_train.shape[2], self.batch_size)
+
     def predict(self, X_test):
-        return self.model.predict(X_test, verbose=0).flatten()
+        return self._predict_fn(X_test)
 
 """
 ARIMA: Math model used for time-series forecasting. Use pre-trained ARIMA model but adjust conditions to eliminate differences
@@ -258,20 +356,24 @@ in whether it is already trained or not
 """
 class ARIMAModel(TimeSeriesModel):
 
-    def __init__(self, order=(5,1,0)):
+    def __init__(self, order=(5,1,0), target_idx=-1):
         super().__init__(f"ARIMA{order}")
         self.order = order
+        # column of the target in the windowed data (prepare_timeseries_data always puts it last)
+        self.target_idx = target_idx
 
     def train(self, X_train, y_train):
-        if len(X_train.shape) > 1:
-            train_data = np.concatenate([X_train.flatten(), y_train])
+        # windows overlap, so the original series is just the first window's target column followed by y_train
+        if X_train.ndim == 3:
+            train_data = np.concatenate([X_train[0, :, self.target_idx], y_train])
         else:
-            train_data = np.concatenate([X_train, y_train])
+            train_data = y_train
 
       # model definition
         self.model = ARIMA(train_data, order=self.order)
         self.fitted_model = self.model.fit()
-        self.model_size = sys.getsizeof(self.fitted_model.params) * 2
+        # the fitted state is basically the parameter and residual arrays
+        self.model_size = self.fitted_model.params.nbytes + self.fitted_model.resid.nbytes
 
     def predict(self, X_test):
         n_steps = len(X_test)
@@ -290,27 +392,37 @@ class GRUModel(TimeSeriesModel):
         self.units = units
         self.epochs = epochs
         self.batch_size = batch_size
+        self._predict_fn = None
 
     def train(self, X_train, y_train):
-        
+        policy = keras_dtype_policy()
 
       # model definition
         self.model = Sequential([
-            GRU(self.units, return_sequences=True, input_shape=(X_train.shape[1], X_train.shape[2])),
-            Dropout(0.2),
-            GRU(self.units // 2),
-            Dropout(0.2),
-            Dense(1)
+            # same cuDNN requirements as the LSTM, plus reset_after=True for GRU
+            GRU(self.units, return_sequences=True, input_shape=(X_train.shape[1], X_train.shape[2]),
+                activation='tanh', recurrent_activation='sigmoid', recurrent_dropout=0.0, unroll=False,
+                reset_after=True, dtype=policy),
+            Dropout(0.2, dtype=policy),
+            GRU(self.units // 2, activation='tanh', recurrent_activation='sigmoid', recurrent_dropout=0.0,
+                unroll=False, reset_after=True, dtype=policy),
+            Dropout(0.2, dtype=policy),
+            Dense(1, dtype='float32')
         ])
 
+        train_ds, val_ds = make_keras_datasets(X_train, y_train, self.batch_size)
+
         self.model.compile(optimizer='adam', loss='mse')
-        self.model.fit(X_train, y_train, epochs=self.epochs, batch_size=self.batch_size,
-                       verbose=0, validation_split=0.1)
+        self.model.fit(train_ds, epochs=self.epochs, verbose=0, validation_data=val_ds)
 
         self.model_size = self.model.count_params() * 4
 
+    def after_train(self, X_train, y_train):
+        # compiles the predict graph, kept out of the training time
+        self._predict_fn = make_predict_fn(self.model, X_train.shape[1], X_train.shape[2], self.batch_size)
+
     def predict(self, X_test):
-        return self.model.predict(X_test, verbose=0).flatten()
+        return self._predict_fn(X_test)
 
 
 class RandomForestModel(TimeSeriesModel):
@@ -321,14 +433,16 @@ class RandomForestModel(TimeSeriesModel):
 
     def train(self, X_train, y_train):
         from sklearn.ensemble import RandomForestRegressor
-        import sys
 
         if len(X_train.shape) == 3:
             X_train = X_train.reshape(X_train.shape[0], -1)
 
-        self.model = RandomForestRegressor(n_estimators=self.n_estimators, random_state=42)
+        self.model = RandomForestRegressor(n_estimators=self.n_estimators, random_state=42, n_jobs=-1)
         self.model.fit(X_train, y_train)
-        self.model_size = sys.getsizeof(self.model) * 2
+
+    def after_train(self, X_train, y_train):
+        # serialized size of the fitted trees
+        self.model_size = len(pickle.dumps(self.model, protocol=5))
 
     def predict(self, X_test):
         if len(X_test.shape) == 3:
@@ -344,14 +458,17 @@ class XGBoostModel(TimeSeriesModel):
 
     def train(self, X_train, y_train):
         from xgboost import XGBRegressor
-        import sys
 
         if len(X_train.shape) == 3:
             X_train = X_train.reshape(X_train.shape[0], -1)
 
-        self.model = XGBRegressor(n_estimators=self.n_estimators, random_state=42, verbosity=0)
+        self.model = XGBRegressor(n_estimators=self.n_estimators, random_state=42, verbosity=0,
+                                  tree_method='hist', n_jobs=-1)
         self.model.fit(X_train, y_train)
-        self.model_size = sys.getsizeof(self.model) * 2
+
+    def after_train(self, X_train, y_train):
+        # serialized size of the fitted trees
+        self.model_size = len(pickle.dumps(self.model, protocol=5))
 
     def predict(self, X_test):
         if len(X_test.shape) == 3:
@@ -386,7 +503,8 @@ def get_model(model_type, **kwargs):
         return GRUModel(units, epochs, batch_size)
     elif model_type == ModelType.ARIMA:
         order = kwargs.get('order', (5, 1, 0))
-        return ARIMAModel(order)
+        target_idx = kwargs.get('target_idx', -1)
+        return ARIMAModel(order, target_idx)
     elif model_type == ModelType.RANDOM_FOREST:
         n_estimators = kwargs.get('n_estimators', 100)
         return RandomForestModel(n_estimators)
@@ -414,6 +532,15 @@ def quick_train(model_number, X_train, y_train, X_test, y_test, **kwargs):
     return model, y_pred
 
 
+# evaluates one model and hands it back (with the error, if any) so it can run in a worker process
+def _eval_one(model, X_train, y_train, X_test, y_test):
+    try:
+        model.evaluate(X_train, y_train, X_test, y_test)
+    except Exception as e:
+        return model, e
+    return model, None
+
+
 class ModelComparator:
 
     def __init__(self):
@@ -423,20 +550,45 @@ class ModelComparator:
     def add_model(self, model):
         self.models.append(model)
 
-    def compare(self, X_train, y_train, X_test, y_test):
+    def compare(self, X_train, y_train, X_test, y_test, n_jobs=1):
+        """
+        n_jobs: number of worker processes for the non-keras models. Defaults to 1 (serial) since
+        models training side by side compete for cores, which makes their training times
+        not comparable with each other or with the keras models
+        """
         print("=" * 80)
         print("TRAINING AND EVALUATING MODELS")
         print("=" * 80)
 
-        for model in self.models:
+        if n_jobs == 1:
+            outputs = {i: _eval_one(m, X_train, y_train, X_test, y_test) for i, m in enumerate(self.models)}
+        else:
+            print("Note: models are trained in parallel, so training times are not comparable")
+
+            # keras models don't survive being forked, so they stay in this process and the rest train in parallel
+            keras_idx = [i for i, m in enumerate(self.models) if isinstance(m, (LSTMModel, GRUModel))]
+            other_idx = [i for i in range(len(self.models)) if i not in keras_idx]
+
+            parallel_out = Parallel(n_jobs=n_jobs, backend='loky')(
+                delayed(_eval_one)(self.models[i], X_train, y_train, X_test, y_test) for i in other_idx)
+
+            outputs = dict(zip(other_idx, parallel_out))
+            for i in keras_idx:
+                outputs[i] = _eval_one(self.models[i], X_train, y_train, X_test, y_test)
+
+        for i in range(len(self.models)):
+            model, error = outputs[i]
+            # workers send back a trained copy, keep that one
+            self.models[i] = model
+
             print(f"\n[{model.name}]")
-            try:
-                model.evaluate(X_train, y_train, X_test, y_test)
-                self.results.append(model.get_summary())
-                print(f"✓ Training time: {model.training_time:.4f}s")
-                print(f"✓ RMSE: {model.metrics['RMSE']:.4f}")
-            except Exception as e:
-                print(f"✗ Error: {e}")
+            if error is not None:
+                print(f"✗ Error: {error}")
+                continue
+
+            self.results.append(model.get_summary())
+            print(f"✓ Training time: {model.training_time:.4f}s")
+            print(f"✓ RMSE: {model.metrics['RMSE']:.4f}")
 
         self.results_df = pd.DataFrame(self.results)
         return self.results_df
@@ -451,12 +603,16 @@ class ModelComparator:
 
         metrics = ['RMSE', 'MAE', 'R2', 'Training Time (s)', 'Model Size (KB)', 'MAPE']
 
+        names = self.results_df['Model'].to_numpy()
+        metric_values = {m: self.results_df[m].to_numpy() for m in metrics}
+        # best is green, second orange, everything else red
+        colors = np.array(['green', 'orange', 'red'])[np.minimum(np.arange(len(names)), 2)]
+
         for idx, (ax, metric) in enumerate(zip(axes.flat, metrics)):
-            data = self.results_df.sort_values(metric, ascending=(metric != 'R2'))
-            colors = ['green' if i == 0 else 'orange' if i == 1 else 'red'
-                     for i in range(len(data))]
+            values = metric_values[metric]
+            order = np.argsort(-values if metric == 'R2' else values, kind='stable')
 
-            ax.barh(data['Model'], data[metric], color=colors, alpha=0.7)
+            ax.barh(names[order], values[order], color=colors, alpha=0.7)
             ax.set_xlabel(metric, fontweight='bold')
             ax.set_title(f'{metric} Comparison', fontweight='bold')
             ax.grid(axis='x', alpha=0.3)
@@ -489,18 +645,21 @@ class ModelComparator:
                 raise ValueError(f"Metric '{metric}' not found in results")
 
         df = self.results_df.copy()
-        df['Weighted_Score'] = 0.0
 
-        for metric, weight in weights.items():
-            values = df[metric].values
+        # min-max normalize every weighted column at once, then a single dot product with the weights
+        cols = list(weights.keys())
+        W = np.array([weights[c] for c in cols])
+        V = df[cols].to_numpy(dtype=np.float64)
+        mn = V.min(axis=0)
+        mx = V.max(axis=0)
+        N = (V - mn) / (mx - mn + 1e-10)
 
-            if metric == 'R2':
-                normalized = (values - values.min()) / (values.max() - values.min() + 1e-10)
-                normalized = 1 - normalized
-            else:
-                normalized = (values - values.min()) / (values.max() - values.min() + 1e-10)
+        # higher R2 is better, so flip it to match the other metrics
+        if 'R2' in cols:
+            r2 = cols.index('R2')
+            N[:, r2] = 1 - N[:, r2]
 
-            df['Weighted_Score'] += normalized * weight
+        df['Weighted_Score'] = N @ W
 
         df_sorted = df.sort_values('Weighted_Score')
 